@@ -7,6 +7,8 @@ def main():
     ap.add_argument("--names", default="data/names_lexicon.txt")
     ap.add_argument("--misspell", default="data/misspell_map.json")
     ap.add_argument("--onnx", default="models/distilbert-base-uncased.int8.onnx")
+    ap.add_argument("--onnx_fp32", default="models/distilbert-base-uncased.onnx")
+    ap.add_argument("--onnx_int4", default="models/distilbert-base-uncased.int4.onnx")
     ap.add_argument("--device", default="cpu")
     ap.add_argument("--runs", type=int, default=100)
     ap.add_argument("--warmup", type=int, default=10)
@@ -14,7 +16,7 @@ def main():
 
     rows = [json.loads(line) for line in open(args.input, 'r', encoding='utf-8')]
     texts = [r["text"] for r in rows][:50]
-    pp = PostProcessor(args.names, misspell_map_path=args.misspell, onnx_model_path=args.onnx, device=args.device, max_length=64)
+    pp = PostProcessor(args.names, misspell_map_path=args.misspell, onnx_model_path=args.onnx, device=args.device, max_length=64, onnx_fp32_path=args.onnx_fp32, cache_size=0, onnx_int4_path=args.onnx_int4)
 
     # Warmup
     for _ in range(args.warmup):
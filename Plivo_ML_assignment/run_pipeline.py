@@ -1,5 +1,5 @@
 import argparse, os
-from src.postprocess_pipeline import run_file
+from src.postprocess_pipeline import run_file_parallel
 
 def main():
     ap = argparse.ArgumentParser()
@@ -8,10 +8,13 @@ def main():
     ap.add_argument("--names", default="data/names_lexicon.txt")
     ap.add_argument("--misspellmap", default="data/misspell_map.json")
     ap.add_argument("--onnx", default="models/distilbert-base-uncased.int8.onnx")
+    ap.add_argument("--onnx_fp32", default="models/distilbert-base-uncased.onnx")
+    ap.add_argument("--onnx_int4", default="models/distilbert-base-uncased.int4.onnx")
     ap.add_argument("--device", default="cpu")
+    ap.add_argument("--workers", type=int, default=1)
     args = ap.parse_args()
     os.makedirs(os.path.dirname(args.output), exist_ok=True)
-    run_file(args.input, args.output, args.names, args.misspellmap, onnx_model_path=args.onnx, device=args.device)
+    run_file_parallel(args.input, args.output, args.names, args.misspellmap, onnx_model_path=args.onnx, device=args.device, onnx_fp32_path=args.onnx_fp32, onnx_int4_path=args.onnx_int4, processes=args.workers)
 
 if __name__ == "__main__":
     main()
@@ -9,7 +9,7 @@ mkdir -p out # This will be needed for step 2's output
 
 # 1) Export and quantize DistilBERT to ONNX (first run only)
 echo "Exporting and quantizing model..."
-python -m src.export_onnx --model distilbert-base-uncased --max_length 64 --out models/distilbert-base-uncased.onnx --quant_out models/distilbert-base-uncased.int8.onnx
+python -m src.export_onnx --model distilbert-base-uncased --max_length 64 --out models/distilbert-base-uncased.onnx --quant_out models/distilbert-base-uncased.int8.onnx --bucket_lengths 16 32 48
 
 # 2) Run pipeline
 echo "Running pipeline..."
@@ -1,17 +1,28 @@
 import argparse
+import json
+import tempfile
+import numpy as np
 import torch
 from transformers import AutoTokenizer, AutoModelForMaskedLM
 import onnx
-from onnxruntime.quantization import quantize_dynamic, QuantType
+from onnxruntime.quantization import quantize_dynamic, quantize_static, QuantType, QuantFormat, CalibrationDataReader
+from onnxruntime.quantization.shape_inference import quant_pre_process
+try:
+    from onnxruntime.quantization.matmul_nbits_quantizer import MatMulNBitsQuantizer
+except ImportError:  # onnxruntime < 1.20 ships it under its old name
+    from onnxruntime.quantization.matmul_4bits_quantizer import MatMul4BitsQuantizer as MatMulNBitsQuantizer
 import os # Make sure os is imported
+from .ranker_onnx import bucket_onnx_path
 
 def export(model_name: str, max_length: int, out_path: str):
     tok = AutoTokenizer.from_pretrained(model_name)
     mdl = AutoModelForMaskedLM.from_pretrained(model_name)
     mdl.eval()
 
-    # Dummy inputs
-    sample = tok("hello world", return_tensors="pt", truncation=True, max_length=max_length)
+    # Dummy inputs, padded to max_length: only the batch axis is dynamic, so the
+    # sequence length is baked in and ORT can specialize/fuse the kernels for it
+    # (the ranker pads its inputs to this length)
+    sample = tok("hello world " * 10, return_tensors="pt", padding="max_length", truncation=True, max_length=max_length)
 
     with torch.no_grad():
         torch.onnx.export(
@@ -27,9 +38,9 @@ def export(model_name: str, max_length: int, out_path: str):
             # It should be 'dynamic_axes', NOT 'dynamic_shapes'
             # The values should be strings, NOT torch.export.Dim
             dynamic_axes={
-                "input_ids": {0: "batch_size", 1: "sequence_len"},
-                "attention_mask": {0: "batch_size", 1: "sequence_len"},
-                "logits": {0: "batch_size", 1: "sequence_len"}
+                "input_ids": {0: "batch_size"},
+                "attention_mask": {0: "batch_size"},
+                "logits": {0: "batch_size"}
             },
             # ------------------------------------
         )
@@ -37,8 +48,43 @@ def export(model_name: str, max_length: int, out_path: str):
     onnx_model = onnx.load(out_path)
     onnx.checker.check_model(onnx_model)
 
-def quantize(in_path: str, out_path: str):
-    quantize_dynamic(in_path, out_path, weight_type=QuantType.QInt8)
+class TranscriptCalibrationReader(CalibrationDataReader):
+    # Feeds the first few transcripts to quantize_static for activation ranges
+    def __init__(self, model_name: str, transcripts_path: str, max_length: int, limit: int = 32):
+        tok = AutoTokenizer.from_pretrained(model_name)
+        texts = [json.loads(line)["text"] for line in open(transcripts_path, 'r', encoding='utf-8')][:limit]
+        feeds = []
+        for t in texts:
+            enc = tok(t, return_tensors="np", padding="max_length", truncation=True, max_length=max_length)
+            feeds.append({"input_ids": enc["input_ids"].astype(np.int64), "attention_mask": enc["attention_mask"].astype(np.int64)})
+        self._feeds = iter(feeds)
+
+    def get_next(self):
+        return next(self._feeds, None)
+
+def quantize(in_path: str, out_path: str, calibration_reader: CalibrationDataReader = None):
+    # Pre-processing folds constants and fills in the shapes the
+    # MatMulInteger / DynamicQuantizeLinear kernels need
+    # (the model is loaded first so external weight files resolve; auto_merge
+    # reconciles the symbolic dims the exporter leaves on the attention ops)
+    # (the pre-processed FP32 copy is only an intermediate, so it lives in a temp dir)
+    with tempfile.TemporaryDirectory() as tmp:
+        pre_path = os.path.join(tmp, "pre.onnx")
+        quant_pre_process(onnx.load(in_path), pre_path, skip_symbolic_shape=False, auto_merge=True)
+        if calibration_reader is not None:
+            # QOperator (fused integer ops) is faster than QDQ on CPU
+            quantize_static(pre_path, out_path, calibration_reader, quant_format=QuantFormat.QOperator,
+                            weight_type=QuantType.QInt8, per_channel=True, extra_options={"MatMulConstBOnly": True})
+        else:
+            quantize_dynamic(pre_path, out_path, weight_type=QuantType.QInt8, per_channel=True, reduce_range=False,
+                             extra_options={"MatMulConstBOnly": True, "EnableSubgraph": True})
+
+def quantize_int4(in_path: str, out_path: str, block_size: int = 32):
+    # Weight-only INT4: MatMuls become MatMulNBits, halving weight bandwidth again vs INT8.
+    # accuracy_level=4 lets MLAS run them with int8 activations.
+    q = MatMulNBitsQuantizer(onnx.load(in_path), block_size=block_size, is_symmetric=True, accuracy_level=4)
+    q.process()
+    onnx.save(q.model.model, out_path)
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
@@ -46,6 +92,10 @@ if __name__ == "__main__":
     ap.add_argument("--max_length", type=int, default=64)
     ap.add_argument("--out", default="models/distilbert-base-uncased.onnx")
     ap.add_argument("--quant_out", default="models/distilbert-base-uncased.int8.onnx")
+    ap.add_argument("--static", action="store_true", help="Static INT8 quantization calibrated on --calib transcripts")
+    ap.add_argument("--calib", default="data/noisy_transcripts.jsonl")
+    ap.add_argument("--int4_out", default=None, help="Also write an INT4 weight-only model here (preferred by the ranker when present)")
+    ap.add_argument("--bucket_lengths", type=int, nargs="*", default=[16, 32, 48], help="Also export fixed-length copies next to each model as *.L<n>.onnx (pass no values to skip)")
     args = ap.parse_args()
 
     # --- THIS IS ALSO NEEDED ---
@@ -58,7 +108,27 @@ if __name__ == "__main__":
     export(args.model, args.max_length, args.out)
     
     print(f"Quantizing model to {args.quant_out}...") # Added print for clarity
-    quantize(args.out, args.quant_out)
+    calib = TranscriptCalibrationReader(args.model, args.calib, args.max_length) if args.static else None
+    quantize(args.out, args.quant_out, calibration_reader=calib)
+
+    if args.int4_out:
+        os.makedirs(os.path.dirname(args.int4_out), exist_ok=True)
+        print(f"Quantizing model to INT4 {args.int4_out}...")
+        quantize_int4(args.out, args.int4_out)
+
+    # Shorter inputs get padded up to --max_length; the ranker runs them on these copies instead
+    for n in args.bucket_lengths:
+        if n >= args.max_length:
+            continue
+        print(f"Exporting length-{n} copies...")
+        out_n = bucket_onnx_path(args.out, n)
+        export(args.model, n, out_n)
+        calib = TranscriptCalibrationReader(args.model, args.calib, n) if args.static else None
+        quantize(out_n, bucket_onnx_path(args.quant_out, n), calibration_reader=calib)
+        if args.int4_out:
+            quantize_int4(out_n, bucket_onnx_path(args.int4_out, n))
     
     print("Exported:", args.out)
-    print("Quantized:", args.quant_out)
\ No newline at end of file
+    print("Quantized:", args.quant_out)
+    if args.int4_out:
+        print("Quantized (INT4):", args.int4_out)
\ No newline at end of file
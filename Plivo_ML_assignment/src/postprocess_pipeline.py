@@ -1,47 +1,119 @@
-import json, time
+import json, os, re, sys, time
+import multiprocessing
+from collections import OrderedDict
 from typing import Dict, List, Set # <-- Import Set
-from .rules import generate_candidates
+from .rules import generate_candidates, build_names_index, build_misspell_pattern, build_misspell_automaton
 from .ranker_onnx import PseudoLikelihoodRanker
 
+# Optional: faster JSONL reading/writing in run_file (falls back to json)
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None
+
+# Sentence starters that make an utterance a question
+_QWORDS = frozenset(("can", "shall", "will", "could", "would", "is", "are", "do", "does", "did", "should", "what", "where", "when", "why", "who", "how"))
+
 class PostProcessor:
-    def __init__(self, names_lex_path: str, misspell_map_path: str, onnx_model_path: str = None, device: str = "cpu", max_length: int = 64):
+    def __init__(self, names_lex_path: str, misspell_map_path: str, onnx_model_path: str = None, device: str = "cpu", max_length: int = 64, onnx_fp32_path: str = None, cache_size: int = 4096, onnx_int4_path: str = None, intra_op_threads: int = None, load_ranker: bool = True):
         # Load the lexicon as a list (used by rules.py)
-        self.names_lex_list = [x.strip() for x in open(names_lex_path, 'r', encoding='utf-8').read().splitlines() if x.strip()]
+        # (split the raw bytes and decode per entry, so the whole file is never held as one str too)
+        with open(names_lex_path, 'rb') as f:
+            data = f.read()
+        self.names_lex_list = [b.strip().decode('utf-8') for b in data.splitlines() if b.strip()]
+        del data
         
         # --- ADD THIS ---
         # Create a lowercase set for fast O(1) name checking in process_one
         self.names_lex_lower_set: Set[str] = {name.lower() for name in self.names_lex_list}
         # --- END ADD ---
+        self._word_re = re.compile(r"[A-Za-z]+")
+
+        # Token length -> length-compatible names, to shrink the fuzzy name search
+        self.names_index: Dict[int, List[str]] = build_names_index(self.names_lex_list)
 
-        self.ranker = PseudoLikelihoodRanker(onnx_path=onnx_model_path, device=device, max_length=max_length)
+        # load_ranker=False defers the ONNX session (run_file_parallel opens one per worker after forking)
+        self._ranker_kwargs = dict(onnx_path=onnx_model_path, device=device, max_length=max_length, onnx_fp32_path=onnx_fp32_path, onnx_int4_path=onnx_int4_path, intra_op_threads=intra_op_threads)
+        self.ranker = None
+        if load_ranker:
+            self.load_ranker()
         
         with open(misspell_map_path, 'r', encoding='utf-8') as f:
             self.misspell = json.load(f)
+        # Compiled once here instead of on every correct_common_misspells call
+        # (the automaton is None when pyahocorasick isn't installed; the regex is used then)
+        self.misspell_re = build_misspell_pattern(self.misspell)
+        self.misspell_ac = build_misspell_automaton(self.misspell)
+
+        # ASR corpora repeat transcripts a lot and the output is pure in `text`, so
+        # process_one and process_batch share one per-instance LRU of finished outputs
+        # (cache_size=0 disables, e.g. for latency runs; None means unbounded)
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+
+    def load_ranker(self, **overrides) -> None:
+        self.ranker = PseudoLikelihoodRanker(**{**self._ranker_kwargs, **overrides})
+
+    def _cache_get(self, text: str) -> str:
+        out = self._cache.get(text)
+        if out is not None:
+            self._cache.move_to_end(text)
+        return out
+
+    def _cache_put(self, text: str, out: str) -> None:
+        if self.cache_size == 0:
+            return
+        self._cache[text] = out
+        if self.cache_size is not None and len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
 
     def process_one(self, text: str) -> str:
+        out = self._cache_get(text)
+        if out is None:
+            out = self._process_one(text)
+            self._cache_put(text, out)
+        return out
+
+    def _process_one(self, text: str) -> str:
         # 1. Generate and rank candidates
         # We pass the original list here for the rules to use
-        cands = generate_candidates(text, self.names_lex_list, self.misspell)
+        cands = generate_candidates(text, self.names_lex_list, self.misspell, self.names_index, self.misspell_re, self.misspell_ac)
         best = self.ranker.choose_best(cands)
+        return self._polish(best)
+
+    def process_batch(self, texts: List[str], batch_size: int = 32) -> List[str]:
+        # Same as process_one, but ranks the candidates of up to batch_size rows together.
+        # Duplicate texts, and texts already in the cache from earlier calls, are only processed once.
+        done, todo = {}, []
+        for t in dict.fromkeys(texts):
+            out = self._cache_get(t)
+            if out is None:
+                todo.append(t)
+            else:
+                done[t] = out
+        for i in range(0, len(todo), batch_size):
+            chunk = todo[i:i + batch_size]
+            cands = [generate_candidates(t, self.names_lex_list, self.misspell, self.names_index, self.misspell_re, self.misspell_ac) for t in chunk]
+            for t, best in zip(chunk, self.ranker.choose_best_batch(cands)):
+                done[t] = self._polish(best)
+                self._cache_put(t, done[t])
+        return [done[t] for t in texts]
+
+    def _cap_name(self, m: re.Match) -> str:
+        # .capitalize() handles "alok" -> "Alok"
+        w = m.group(0)
+        return w.capitalize() if w.lower() in self.names_lex_lower_set else w
 
+    def _polish(self, best: str) -> str:
         # --- START NEW/MODIFIED LOGIC ---
 
         # 2. Capitalize names (Goal 1), but skip emails
-        processed_tokens = []
-        for token in best.split():
-            # Check 1: Is it an email? If yes, leave it alone.
-            if '@' in token:
-                processed_tokens.append(token)
-            
-            # Check 2: Is it a name?
-            # We strip punctuation to match "Alok." or "Ansh?"
-            elif token.lower().strip('.,?!') in self.names_lex_lower_set:
-                # .capitalize() handles "alok" -> "Alok"
-                processed_tokens.append(token.capitalize())
-            else:
-                processed_tokens.append(token)
-        
-        best = ' '.join(processed_tokens)
+        # One regex scan over the words; tokens holding an email are left alone
+        best = ' '.join(best.split())
+        if '@' not in best:
+            best = self._word_re.sub(self._cap_name, best)
+        else:
+            best = ' '.join(t if '@' in t else self._word_re.sub(self._cap_name, t) for t in best.split(' '))
 
         # 3. Final polish: Capitalize first letter (Goal 2) & add punctuation
         best = best.strip()
@@ -54,33 +126,78 @@ class PostProcessor:
         # --- END NEW/MODIFIED LOGIC ---
         
         # (Original punctuation logic)
-        lower = best.lower() # Use the new 'best'
-        if lower.endswith(('?', '.', ',')) is False:
-            first_word = lower.split()[0] if lower.split() else ""
-            if first_word in ('can','shall','will','could','would','is','are','do','does','did','should','what','where','when','why','who','how'):
-                best = best.rstrip() + '?'
-            else:
-                best = best.rstrip() + '.'
+        # (best is stripped and single-spaced here, so partition finds the first word)
+        if not best.endswith(('?', '.', ',')):
+            first_word = best.partition(' ')[0].lower()
+            best = best.rstrip() + ('?' if first_word in _QWORDS else '.')
         return best
 
 # ... (rest of the file is unchanged) ...
 
-def run_file(input_path: str, output_path: str, names_lex_path: str, misspell_map_path: str, onnx_model_path: str = None, device: str = "cpu", max_length: int = 64):
-    pp = PostProcessor(names_lex_path, misspell_map_path=misspell_map_path, onnx_model_path=onnx_model_path, device=device, max_length=max_length)
+def run_file(input_path: str, output_path: str, names_lex_path: str, misspell_map_path: str, onnx_model_path: str = None, device: str = "cpu", max_length: int = 64, onnx_fp32_path: str = None, onnx_int4_path: str = None, batch_size: int = 64):
+    pp = PostProcessor(names_lex_path, misspell_map_path=misspell_map_path, onnx_model_path=onnx_model_path, device=device, max_length=max_length, onnx_fp32_path=onnx_fp32_path, onnx_int4_path=onnx_int4_path)
     
     # --- ADDED: Ensure output directory exists ---
-    import os
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     # --- END ADD ---
 
-    rows = [json.loads(line) for line in open(input_path, 'r', encoding='utf-8')]
-    out = []
-    for r in rows:
-        pred = pp.process_one(r["text"])
-        out.append({"id": r["id"], "text": pred})
-    with open(output_path, 'w', encoding='utf-8') as f:
-        for o in out:
-            f.write(json.dumps(o, ensure_ascii=False) + "\n")
+    # Stream: read batch_size rows, process them together, write them out, repeat
+    with open(input_path, 'rb') as fin, open(output_path, 'wb', buffering=1 << 20) as fout:
+        rows = []
+        for line in fin:
+            if not line.strip():
+                continue
+            rows.append(_loads(line))
+            if len(rows) == batch_size:
+                _write_batch(pp, rows, fout)
+                rows = []
+        if rows:
+            _write_batch(pp, rows, fout)
+
+def _loads(line: bytes) -> dict:
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+def _dumps(obj: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj) + b"\n"
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+def _write_batch(pp: PostProcessor, rows: List[dict], fout) -> None:
+    preds = pp.process_batch([r["text"] for r in rows])
+    for r, pred in zip(rows, preds):
+        fout.write(_dumps({"id": r["id"], "text": pred}))
+
+# Per-worker PostProcessor for run_file_parallel (set by _init_pp in each worker)
+_worker_pp = None
+
+def _init_pp(pp: PostProcessor) -> None:
+    global _worker_pp
+    # pp (lexicon, names index, misspell automaton) was built in the parent and is
+    # shared copy-on-write by the fork; each worker only opens its own ONNX session,
+    # single-threaded so N workers don't oversubscribe the cores
+    pp.load_ranker(intra_op_threads=1)
+    _worker_pp = pp
+
+def _process_line(line: bytes) -> bytes:
+    r = _loads(line)
+    return _dumps({"id": r["id"], "text": _worker_pp.process_one(r["text"])})
+
+def run_file_parallel(input_path: str, output_path: str, names_lex_path: str, misspell_map_path: str, onnx_model_path: str = None, device: str = "cpu", max_length: int = 64, onnx_fp32_path: str = None, onnx_int4_path: str = None, processes: int = None):
+    # Same output as run_file, with rows spread over a pool of forked worker processes.
+    # Needs the "fork" start method; elsewhere (Windows, or with a single process) it falls back to run_file.
+    processes = processes or os.cpu_count() or 1
+    if sys.platform == "win32" or processes < 2 or "fork" not in multiprocessing.get_all_start_methods():
+        return run_file(input_path, output_path, names_lex_path, misspell_map_path, onnx_model_path=onnx_model_path, device=device, max_length=max_length, onnx_fp32_path=onnx_fp32_path, onnx_int4_path=onnx_int4_path)
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    # No ONNX session in the parent: ORT's thread pools don't survive a fork
+    pp = PostProcessor(names_lex_path, misspell_map_path=misspell_map_path, onnx_model_path=onnx_model_path, device=device, max_length=max_length, onnx_fp32_path=onnx_fp32_path, onnx_int4_path=onnx_int4_path, load_ranker=False)
+    with open(input_path, 'rb') as fin, open(output_path, 'wb', buffering=1 << 20) as fout:
+        lines = (line for line in fin if line.strip())
+        with multiprocessing.get_context("fork").Pool(processes=processes, initializer=_init_pp, initargs=(pp,)) as pool:
+            # imap keeps input order
+            for out in pool.imap(_process_line, lines, chunksize=64):
+                fout.write(out)
 
 # --- ADDED: Argument parsing to make the script runnable ---
 if __name__ == '__main__':
@@ -92,19 +209,26 @@ if __name__ == '__main__':
     ap.add_argument("--names", default="data/names_lexicon.txt", help="Path to names lexicon")
     ap.add_argument("--misspell", default="data/misspell_map.json", help="Path to misspell map")
     ap.add_argument("--onnx", default="models/distilbert-base-uncased.int8.onnx", help="Path to ONNX model")
+    ap.add_argument("--onnx_fp32", default="models/distilbert-base-uncased.onnx", help="FP32 ONNX model used instead of --onnx on CPUs without VNNI")
+    ap.add_argument("--onnx_int4", default="models/distilbert-base-uncased.int4.onnx", help="INT4 ONNX model used instead of --onnx when it exists")
     ap.add_argument("--device", default="cpu", help="Device to run on (cpu or cuda)")
     ap.add_argument("--max_length", type=int, default=64, help="Max sequence length for ranker")
+    ap.add_argument("--workers", type=int, default=1, help="Worker processes (1 = single process)")
     
     args = ap.parse_args()
 
-    run_file(
+    # workers=1 falls through to the single-process run_file
+    run_file_parallel(
         input_path=args.input,
         output_path=args.output,
         names_lex_path=args.names,
         misspell_map_path=args.misspell,
         onnx_model_path=args.onnx,
+        onnx_fp32_path=args.onnx_fp32,
+        onnx_int4_path=args.onnx_int4,
         device=args.device,
-        max_length=args.max_length
+        max_length=args.max_length,
+        processes=args.workers
     )
     
     print(f"Processing complete. Output written to {args.output}")
@@ -1,57 +1,116 @@
 import re
-from typing import List, Set, Tuple, Dict
+from typing import List, Set, Tuple, Dict, Optional, Pattern
 from rapidfuzz import process, fuzz
 
+# Optional: Aho-Corasick matching for the misspell map (falls back to the regex)
+try:
+    import ahocorasick  # type: ignore
+except Exception:
+    ahocorasick = None
 
-# For correct_common_misspells (dynamic, compiled in function)
+
+# For correct_common_misspells (built from the map, see build_misspell_pattern
+# and build_misspell_automaton)
 
 
 # For normalize_email_tokens
-EMAIL_TOKEN_PATTERNS = [
-    (re.compile(r'\b(dot)\b', re.IGNORECASE), '.'),
-    (re.compile(r'\b(underscore)\b', re.IGNORECASE), '_'),
-]
+SURNAMES = ('mehta', 'sharma', 'patel', 'gupta', 'singh', 'kumar', 'verma')
 EMAIL_CLEANUP_PATTERNS = [
     # (BUGFIX) Handle "g mail", "y hoo", etc.
     (re.compile(r'\b(g)\s+(mail)\b', re.IGNORECASE), r'gmail'),
     (re.compile(r'\b(y)\s+(hoo)\b', re.IGNORECASE), r'yahoo'),
     
     # Fixes the (.) before surname (mehta) in the email address.
-    (re.compile(r'([a-zA-Z0-9.-]+)(mehta|sharma|patel|gupta|singh|kumar|verma)\b', re.IGNORECASE), r'\1.\2'),
-    
-    # TLD fixes (order matters: specific 'acin'/'coin' first)
-    (re.compile(r'(@[a-zA-Z0-9.-]+)(acin)\b', re.IGNORECASE), r'\1.ac.in'),
-    (re.compile(r'(@[a-zA-Z0-9.-]+)(coin)\b', re.IGNORECASE), r'\1.co.in'),
-    (re.compile(r'(@[a-zA-Z0-9.-]+)(com|in|org|net|edu)\b', re.IGNORECASE), r'\1.\2'),
-    
-    # Cleans up spaces: 'user @ gmail . com' -> 'user@gmail.com'
-    (re.compile(r'\s*([@\.])\s*'), r'\1'),
+    (re.compile(r'([a-zA-Z0-9.-]+)(' + '|'.join(SURNAMES) + r')\b', re.IGNORECASE), r'\1.\2'),
 ]
+# Spoken "dot"/"underscore" and the TLD fixes in a single scan (see _email_onepass_sub).
+# The lazy domain stops at the first TLD, so 'acin'/'coin' win over a trailing 'in',
+# and it can't end in '.', so an already-dotted domain is left alone.
+EMAIL_ONEPASS = re.compile(r'\b(dot|underscore)\b|(@[a-zA-Z0-9.-]*?[a-zA-Z0-9-])(acin|coin|com|in|org|net|edu)\b', re.IGNORECASE)
+EMAIL_TOKEN_MAP = {'dot': '.', 'underscore': '_'}
+EMAIL_TLD_MAP = {'acin': '.ac.in', 'coin': '.co.in'}
+# Cleans up spaces: 'user @ gmail . com' -> 'user@gmail.com'
+EMAIL_SPACE_PATTERN = re.compile(r'\s*([@\.])\s*')
 
 # For normalize_indian_units
-SMALL_NUM_PATTERNS = [
-    (re.compile(r'\bone\b', re.IGNORECASE), '1'),
-    (re.compile(r'\btwo\b', re.IGNORECASE), '2'),
+SMALL_NUM_WORDS = {
+    'one': '1',
+    'two': '2',
     # (add more as needed)
-]
+}
+SMALL_NUM_RE = re.compile(r'\b(' + '|'.join(SMALL_NUM_WORDS) + r')\b', re.IGNORECASE)
 INDIAN_UNIT_PATTERN = re.compile(r'(\d[\d,.]*)\s+(lakh|crore)\b', re.IGNORECASE)
 THOUSAND_PATTERN = re.compile(r'(\d[\d,.]*)\s+thousand\b', re.IGNORECASE)
 
-# For indian_group
-INDIAN_GROUPING_PATTERN = re.compile(r'(\d)(?=(\d\d)+\d$)')
+# For correct_names_with_lexicon: (leading punct, word, trailing punct)
+_PUNCT_SPLIT = re.compile(r'^([.,?!]*)(.*?)([.,?!]*)$')
 
 # For normalize_currency
 CURRENCY_SYMBOL_PATTERN = re.compile(r'\b(rupees|rs)\b\s*', re.IGNORECASE)
 CURRENCY_FORMAT_PATTERN = re.compile(r'(₹)\s*([0-9,]+)\b')
 
 # --- 2. Misspellings ---
-def correct_common_misspells(text: str, misspell_map: Dict[str, str]) -> str:
+def build_misspell_pattern(misspell_map: Dict[str, str]) -> Optional[Pattern]:
+    single_word_keys = [k for k in misspell_map.keys() if ' ' not in k]
+    if not single_word_keys:
+        return None
+    return re.compile(r'\b(' + '|'.join(re.escape(k) for k in single_word_keys) + r')\b', re.IGNORECASE)
 
+def build_misspell_automaton(misspell_map: Dict[str, str]):
+    # One automaton over all keys: a single scan of the text whatever the map size.
+    # Each key keeps its map order so overlapping hits resolve like the regex alternation.
+    if ahocorasick is None:
+        return None
     single_word_keys = [k for k in misspell_map.keys() if ' ' not in k]
     if not single_word_keys:
+        return None
+    automaton = ahocorasick.Automaton()
+    for order, k in enumerate(single_word_keys):
+        automaton.add_word(k.lower(), (order, len(k), misspell_map[k]))
+    automaton.make_automaton()
+    return automaton
+
+def _is_word_boundary(s: str, i: int) -> bool:
+    # Same test as the regex \b
+    before = i > 0 and (s[i - 1].isalnum() or s[i - 1] == '_')
+    after = i < len(s) and (s[i].isalnum() or s[i] == '_')
+    return before != after
+
+def _replace_with_automaton(text: str, automaton) -> Optional[str]:
+    lower = text.lower()
+    if len(lower) != len(text):
+        return None  # lower() changed the length, so offsets don't line up
+    hits = []
+    for end, (order, n, rep) in automaton.iter(lower):
+        start, stop = end - n + 1, end + 1
+        if _is_word_boundary(text, start) and _is_word_boundary(text, stop):
+            hits.append((start, order, stop, rep))
+    if not hits:
         return text
+    # Leftmost match wins, then the earliest key, as with re.sub
+    hits.sort()
+    out = []
+    pos = 0
+    for start, _, stop, rep in hits:
+        if start < pos:
+            continue
+        out.append(text[pos:start])
+        out.append(rep)
+        pos = stop
+    out.append(text[pos:])
+    return ''.join(out)
 
-    pattern = re.compile(r'\b(' + '|'.join(re.escape(k) for k in single_word_keys) + r')\b', re.IGNORECASE)
+def correct_common_misspells(text: str, misspell_map: Dict[str, str], pattern: Optional[Pattern] = None, automaton=None) -> str:
+    # Pass an automaton (build_misspell_automaton) or a pattern (build_misspell_pattern)
+    # to skip rebuilding the matcher on every call
+    if automaton is not None:
+        replaced = _replace_with_automaton(text, automaton)
+        if replaced is not None:
+            return replaced
+    if pattern is None:
+        pattern = build_misspell_pattern(misspell_map)
+    if pattern is None:
+        return text
     return pattern.sub(lambda m: misspell_map[m.group(0).lower()], text)
 
 
@@ -75,13 +134,19 @@ def collapse_spelled_letters(s: str) -> str:
             i += 1
     return ' '.join(out)
 
+def _email_onepass_sub(m: re.Match) -> str:
+    if m.group(1):
+        return EMAIL_TOKEN_MAP[m.group(1).lower()]
+    tld = m.group(3)
+    return m.group(2) + EMAIL_TLD_MAP.get(tld.lower(), '.' + tld)
+
 def normalize_email_tokens(s: str) -> str:
     s2 = s
     s2 = collapse_spelled_letters(s2)
-    for pat, rep in EMAIL_TOKEN_PATTERNS:
-        s2 = pat.sub(rep, s2)
     for pat, rep in EMAIL_CLEANUP_PATTERNS:
         s2 = pat.sub(rep, s2)
+    s2 = EMAIL_ONEPASS.sub(_email_onepass_sub, s2)
+    s2 = EMAIL_SPACE_PATTERN.sub(r'\1', s2)
     return s2
 
 # --- 4. Number Normalization ---
@@ -129,100 +194,150 @@ def normalize_numbers_spoken(s: str) -> str:
 
 INDIAN_UNITS = {'lakh': 100000, 'crore': 10000000}
 
+# For generate_candidates: anything the email/number/currency rules can rewrite.
+# Digits, '@' and '₹'; a '.' next to whitespace (EMAIL_SPACE_PATTERN); number,
+# unit and spoken-email words; a glued surname; two single letters in a row
+# (collapse_spelled_letters). Text without a match only differs after the name pass.
+_CHEAP_TRIGGER = re.compile(
+    r'[@0-9₹]|\s\.|\.\s'
+    r'|\b(?:' + '|'.join(list(NUM_WORD) + ['double', 'triple', 'lakh', 'crore', 'thousand', 'rupees', 'rs', 'dot', 'underscore']) + r')\b'
+    r'|\b[gy]\s+(?:mail|hoo)\b'
+    r'|[a-zA-Z0-9.-](?:' + '|'.join(SURNAMES) + r')\b'
+    r'|\b[^\W\d_]\s+[^\W\d_]\b',
+    re.IGNORECASE,
+)
+
+# Replacement callbacks live at module level so they aren't rebuilt on every call
+def _small_num_replacer(m: re.Match) -> str:
+    return SMALL_NUM_WORDS[m.group(1).lower()]
+
+def _unit_replacer(m: re.Match) -> str:
+    try:
+        value = float(m.group(1))
+        unit = m.group(2).lower()
+        total = value * INDIAN_UNITS[unit]
+        return str(int(total))
+    except:
+        return m.group(0)
+
+def _thousand_replacer(m: re.Match) -> str:
+    return str(int(float(m.group(1)) * 1000))
+
 def normalize_indian_units(s: str) -> str:
-    def unit_replacer(m):
-        try:
-            value = float(m.group(1))
-            unit = m.group(2).lower()
-            total = value * INDIAN_UNITS[unit]
-            return str(int(total))
-        except:
-            return m.group(0)
-
-    for pat, rep in SMALL_NUM_PATTERNS:
-        s = pat.sub(rep, s)
+    s = SMALL_NUM_RE.sub(_small_num_replacer, s)
     
-    s = INDIAN_UNIT_PATTERN.sub(unit_replacer, s)
-    s = THOUSAND_PATTERN.sub(lambda m: str(int(float(m.group(1)) * 1000)), s)
+    s = INDIAN_UNIT_PATTERN.sub(_unit_replacer, s)
+    s = THOUSAND_PATTERN.sub(_thousand_replacer, s)
     return s
 
 def indian_group(num_str: str) -> str:
     if not num_str.isdigit() or len(num_str) <= 3:
         return num_str
     
+    # Last three digits, then pairs walking left: 1234567 -> 12,34,567
     last3 = num_str[-3:]
     rest = num_str[:-3]
-    grouped_rest = INDIAN_GROUPING_PATTERN.sub(r'\1,', rest)
-    return grouped_rest + ',' + last3
+    groups = []
+    i = len(rest)
+    while i > 2:
+        groups.append(rest[i-2:i])
+        i -= 2
+    if i > 0:
+        groups.append(rest[:i])
+    return ','.join(reversed(groups)) + ',' + last3
+
+def _currency_replacer(m: re.Match) -> str:
+    raw_num = m.group(2).replace(',', '')
+    if raw_num.isdigit():
+        return '₹' + indian_group(raw_num)
+    return m.group(0)
 
 def normalize_currency(s: str) -> str:
     s = normalize_indian_units(s)
     s = CURRENCY_SYMBOL_PATTERN.sub('₹', s)
-    
-    def repl(m):
-        raw_num = m.group(2).replace(',', '')
-        if raw_num.isdigit():
-            return '₹' + indian_group(raw_num)
-        return m.group(0)
-
-    s = CURRENCY_FORMAT_PATTERN.sub(repl, s)
+    s = CURRENCY_FORMAT_PATTERN.sub(_currency_replacer, s)
     return s
 
 # --- 5. Name Correction (Performance) ---
-def correct_names_with_lexicon(s: str, names_lex: List[str], threshold: int = 90) -> str:
+def build_names_index(names_lex: List[str], threshold: int = 90) -> Dict[int, List[str]]:
+    # fuzz.ratio can't exceed 200*min(a, b)/(a + b) for lengths a and b, so only
+    # names of a similar length can reach the threshold. Map each token length to
+    # those names, kept in lexicon order so ties resolve exactly as with the flat list.
+    max_len = max((len(n) for n in names_lex), default=0)
+    index: Dict[int, List[str]] = {}
+    for a in range(1, 2 * max_len + 1):
+        index[a] = [n for n in names_lex if 200 * min(a, len(n)) >= threshold * (a + len(n))]
+    return index
+
+def correct_names_with_lexicon(s: str, names_lex: List[str], threshold: int = 90, names_index: Dict[int, List[str]] = None) -> str:
+    # names_index (from build_names_index, same threshold) narrows each token's
+    # search to length-compatible names; tokens outside it fall back to names_lex
     tokens = s.split()
-    out = []
-    for t in tokens:
-        # (LATENCY FIX) Strip punctuation *before* the check
-        clean_t = t.strip('.,?!')
-        
-        # Guard condition to skip slow fuzzy search
-        if not clean_t.isalpha() or len(clean_t) <= 2:
-            out.append(t)
+    # (LATENCY FIX) Strip punctuation *before* the check
+    parts = [_PUNCT_SPLIT.match(t).groups() for t in tokens]
+    clean_tokens = [core for _, core, _ in parts]
+
+    # Guard condition to skip slow fuzzy search
+    idx = [i for i, c in enumerate(clean_tokens) if c.isalpha() and len(c) > 2]
+    if not idx or not names_lex:
+        return ' '.join(tokens)
+
+    # Tokens sharing a candidate list are scored together in one cdist call;
+    # argmax keeps extractOne's tie-break (first name in the list wins)
+    groups: Dict[int, List[int]] = {}
+    for i in idx:
+        key = len(clean_tokens[i]) if names_index is not None else 0
+        groups.setdefault(key, []).append(i)
+    for key, group in groups.items():
+        cands = names_index.get(key, names_lex) if names_index is not None else names_lex
+        if not cands:
             continue
-            
-        best = process.extractOne(clean_t, names_lex, scorer=fuzz.ratio)
-        if best and best[1] >= threshold:
-            # Re-apply punctuation by replacing the clean part
-            out.append(t.replace(clean_t, best[0]))
-        else:
-            out.append(t)
-    return ' '.join(out)
+        scores = process.cdist([clean_tokens[i] for i in group], cands, scorer=fuzz.ratio, score_cutoff=threshold)
+        best = scores.argmax(axis=1)
+        for row, i in enumerate(group):
+            j = best[row]
+            if scores[row, j] >= threshold:
+                # Re-apply the punctuation around the corrected name
+                lead, _, trail = parts[i]
+                tokens[i] = lead + cands[j] + trail
+    return ' '.join(tokens)
 
 # --- 6. Candidate Generation (Improved) ---
 def generate_candidates(
     text: str, 
     names_lex: List[str], 
-    misspell_map: Dict[str, str]
+    misspell_map: Dict[str, str],
+    names_index: Dict[int, List[str]] = None,
+    misspell_re: Optional[Pattern] = None,
+    misspell_ac=None
 ) -> List[str]:
+    # 1. Base: High-precision common misspellings
+    t_base = correct_common_misspells(text, misspell_map, misspell_re, misspell_ac)
+
+    # Fast path: no rule below would fire, so every candidate collapses to the
+    # (whitespace-normalized) text or its name-corrected form
+    if t_base == text and not _CHEAP_TRIGGER.search(text):
+        t_names = correct_names_with_lexicon(text, names_lex, names_index=names_index)
+        return [text] if t_names == ' '.join(text.split()) else [text, t_names]
+
     cands: Set[str] = set()
     cands.add(text) # Always include original
-
-    # 1. Base: High-precision common misspellings
-    t_base = correct_common_misspells(text, misspell_map)
     cands.add(t_base)
 
+    # Shared prefixes: every branch below starts from the email-normalized text,
+    # and the two numbers/currency branches share that stage too
+    t_em = normalize_email_tokens(t_base)
+    t_em_num_cur = normalize_currency(normalize_numbers_spoken(t_em))
+
     # 2. Full Pipeline Candidate
-    t_full = normalize_email_tokens(t_base)
-    t_full = normalize_numbers_spoken(t_full)
-    t_full = normalize_currency(t_full)
-    t_full = correct_names_with_lexicon(t_full, names_lex)
+    t_full = correct_names_with_lexicon(t_em_num_cur, names_lex, names_index=names_index)
     cands.add(t_full)
 
     # 3. Ablation: No Name Correction
-    t_no_names = normalize_email_tokens(t_base)
-    t_no_names = normalize_numbers_spoken(t_no_names)
-    t_no_names = normalize_currency(t_no_names)
-    cands.add(t_no_names)
-
-    # 4. Ablation: No Number/Currency Correction
-    t_no_nums = normalize_email_tokens(t_base)
-    t_no_nums = correct_names_with_lexicon(t_no_nums, names_lex)
-    cands.add(t_no_nums)
-
-    # 5. Ablation: Emails + Names only
-    t_email_name = normalize_email_tokens(t_base)
-    t_email_name = correct_names_with_lexicon(t_email_name, names_lex)
+    cands.add(t_em_num_cur)
+
+    # 4. Ablation: Emails + Names only (no Number/Currency Correction)
+    t_email_name = correct_names_with_lexicon(t_em, names_lex, names_index=names_index)
     cands.add(t_email_name)
 
     # Deduplicate and cap
@@ -2,9 +2,10 @@ import re
 import math
 
 PUNCS = ['.', ',', '?']
+PUNC_RE = re.compile(r'[\.,\?]+')
 
 def strip_punc(s: str) -> str:
-    return re.sub(r'[\.,\?]+', '', s)
+    return PUNC_RE.sub('', s)
 
 def punctuation_f1(pred: str, gold: str):
     def seq(x): return [c for c in x if c in PUNCS]